@@ -26,16 +26,17 @@
 dbutils.widgets.text("catalog_name", "sandbox", "01. Catalog Name")
 dbutils.widgets.text("schema_name", "churn_genie_demo", "02. Schema Name")
 
-# Get and display configuration
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
+# Get and display configuration (read once; every cell below uses these)
+CATALOG = dbutils.widgets.get("catalog_name")
+SCHEMA = dbutils.widgets.get("schema_name")
+FQ = f"{CATALOG}.{SCHEMA}"
 
 print("="*70)
 print(" CONFIGURATION")
 print("="*70)
-print(f" Catalog:    {catalog}")
-print(f" Schema:     {schema}")
-print(f" Full path:  {catalog}.{schema}")
+print(f" Catalog:    {CATALOG}")
+print(f" Schema:     {SCHEMA}")
+print(f" Full path:  {FQ}")
 print("="*70)
 print()
 print("✅ Configuration loaded!")
@@ -50,32 +51,51 @@ print("🚀 Run the next cells to create your dataset")
 # COMMAND ----------
 
 # Setup catalog and schema
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
-
-print(f"Setting up {catalog}.{schema}...")
-
-spark.sql(f"USE CATALOG {catalog}")
-spark.sql(f"CREATE SCHEMA IF NOT EXISTS {schema}")
-spark.sql(f"USE SCHEMA {schema}")
-
-print(f"✅ Using {catalog}.{schema}")
+from delta.tables import DeltaTable
+
+print(f"Setting up {FQ}...")
+
+spark.sql(f"USE CATALOG {CATALOG}")
+spark.sql(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+spark.sql(f"USE SCHEMA {SCHEMA}")
+
+print(f"✅ Using {FQ}")
+
+def creation_metrics(table):
+    """Row count recorded by the table's CREATE commit in the Delta log (no data scan)"""
+    return (DeltaTable.forName(spark, f"{FQ}.{table}").history()
+            .where("version = 0")
+            .selectExpr(f"'{table}' AS table", "CAST(operationMetrics['numOutputRows'] AS BIGINT) AS num_records"))
+
+def table_row_count(table):
+    return creation_metrics(table).first()["num_records"]
+
+def clustered_table_ddl(table, *stats_columns):
+    """CREATE TABLE ... AS prefix for a table liquid clustered on customer_id_int, with data-skipping stats on the filter columns"""
+    return f"""
+CREATE TABLE {FQ}.{table}
+CLUSTER BY (customer_id_int)
+TBLPROPERTIES (
+  'delta.autoOptimize.optimizeWrite' = 'true',
+  'delta.autoOptimize.autoCompact' = 'true',
+  'delta.dataSkippingStatsColumns' = '{",".join(["customer_id_int", *stats_columns])}'
+)
+AS"""
 
 # COMMAND ----------
 
 # Drop existing objects if they exist
 tables = ['customers', 'accounts', 'usage_data', 'support_tickets', 
-          'billing_payments', 'network_quality', 'churn_labels']
-views = ['customer_support_summary', 'latest_usage', 'customer_360', 'high_risk_customers']
-
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
+          'billing_payments', 'network_quality', 'churn_labels', 'customer_360']
+views = ['customer_support_summary', 'latest_usage', 'high_risk_customers']
 
 print("Cleaning up existing tables/views...")
-for table in tables:
-    spark.sql(f"DROP TABLE IF EXISTS {catalog}.{schema}.{table}")
-for view in views:
-    spark.sql(f"DROP VIEW IF EXISTS {catalog}.{schema}.{view}")
+# Drop by the existing object's type, since earlier versions created some of these
+# as views (e.g. customer_360) and DROP TABLE fails on a view
+for name in tables + views:
+    if spark.catalog.tableExists(f"{FQ}.{name}"):
+        object_type = "VIEW" if spark.catalog.getTable(f"{FQ}.{name}").tableType == "VIEW" else "TABLE"
+        spark.sql(f"DROP {object_type} IF EXISTS {FQ}.{name}")
     
 print("✅ Cleanup complete")
 
@@ -84,18 +104,14 @@ print("✅ Cleanup complete")
 # MAGIC %md
 # MAGIC ## Step 3: Create Tables
 # MAGIC
-# MAGIC This will take 2-3 minutes total
+# MAGIC Tables 2-6 only depend on customers, so their queries are defined first and written in parallel.
 
 # COMMAND ----------
 
 # DBTITLE 1,1. Customers Table (5,000 records)
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
-
 print("Creating customers...")
 
-spark.sql(f"""
-CREATE TABLE {catalog}.{schema}.customers AS
+customers_df = spark.sql("""
 WITH customer_ids AS (
   SELECT 
     CONCAT('CUST', LPAD(CAST(id AS STRING), 6, '0')) AS customer_id, 
@@ -107,98 +123,91 @@ WITH customer_ids AS (
     ABS(HASH(id, 5)) % 100 AS rand5
   FROM RANGE(1, 5001)
 )
+-- Name and location columns pick evenly sized buckets of the 0-99 draw from a constant array
 SELECT 
   customer_id,
-  CASE WHEN rand1 < 6 THEN 'John' WHEN rand1 < 12 THEN 'Jane' WHEN rand1 < 19 THEN 'Michael'
-       WHEN rand1 < 25 THEN 'Sarah' WHEN rand1 < 31 THEN 'David' WHEN rand1 < 37 THEN 'Emma'
-       WHEN rand1 < 44 THEN 'Robert' WHEN rand1 < 50 THEN 'Lisa' WHEN rand1 < 56 THEN 'James'
-       WHEN rand1 < 62 THEN 'Maria' WHEN rand1 < 69 THEN 'William' WHEN rand1 < 75 THEN 'Jennifer'
-       WHEN rand1 < 81 THEN 'Daniel' WHEN rand1 < 87 THEN 'Jessica' WHEN rand1 < 94 THEN 'Joseph' ELSE 'Ashley' END AS first_name,
-  CASE WHEN rand2 < 7 THEN 'Smith' WHEN rand2 < 13 THEN 'Johnson' WHEN rand2 < 20 THEN 'Williams'
-       WHEN rand2 < 27 THEN 'Brown' WHEN rand2 < 33 THEN 'Jones' WHEN rand2 < 40 THEN 'Garcia'
-       WHEN rand2 < 47 THEN 'Miller' WHEN rand2 < 53 THEN 'Davis' WHEN rand2 < 60 THEN 'Rodriguez'
-       WHEN rand2 < 67 THEN 'Martinez' WHEN rand2 < 73 THEN 'Hernandez' WHEN rand2 < 80 THEN 'Lopez'
-       WHEN rand2 < 87 THEN 'Wilson' WHEN rand2 < 93 THEN 'Anderson' ELSE 'Thomas' END AS last_name,
+  id AS customer_id_int,
+  ELEMENT_AT(ARRAY('John', 'Jane', 'Michael', 'Sarah', 'David', 'Emma', 'Robert', 'Lisa', 'James', 'Maria', 'William', 'Jennifer', 'Daniel', 'Jessica', 'Joseph', 'Ashley'),
+             CAST(rand1 * 16 DIV 100 AS INT) + 1) AS first_name,
+  ELEMENT_AT(ARRAY('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas'),
+             CAST(rand2 * 15 DIV 100 AS INT) + 1) AS last_name,
   CAST(18 + (ABS(HASH(id, 6)) % 57) AS INT) AS age,
   CASE WHEN rand3 < 48 THEN 'M' WHEN rand3 < 96 THEN 'F' ELSE 'Other' END AS gender,
-  CASE WHEN rand4 < 7 THEN 'CA' WHEN rand4 < 13 THEN 'TX' WHEN rand4 < 20 THEN 'FL' WHEN rand4 < 27 THEN 'NY'
-       WHEN rand4 < 33 THEN 'PA' WHEN rand4 < 40 THEN 'IL' WHEN rand4 < 47 THEN 'OH' WHEN rand4 < 53 THEN 'GA'
-       WHEN rand4 < 60 THEN 'NC' WHEN rand4 < 67 THEN 'MI' WHEN rand4 < 73 THEN 'NJ' WHEN rand4 < 80 THEN 'VA'
-       WHEN rand4 < 87 THEN 'WA' WHEN rand4 < 93 THEN 'AZ' ELSE 'MA' END AS state,
-  CASE WHEN rand5 < 7 THEN 'Los Angeles' WHEN rand5 < 13 THEN 'Houston' WHEN rand5 < 20 THEN 'Phoenix'
-       WHEN rand5 < 27 THEN 'San Antonio' WHEN rand5 < 33 THEN 'San Diego' WHEN rand5 < 40 THEN 'Dallas'
-       WHEN rand5 < 47 THEN 'San Jose' WHEN rand5 < 53 THEN 'Austin' WHEN rand5 < 60 THEN 'Jacksonville'
-       WHEN rand5 < 67 THEN 'Fort Worth' WHEN rand5 < 73 THEN 'Columbus' WHEN rand5 < 80 THEN 'Charlotte'
-       WHEN rand5 < 87 THEN 'Seattle' WHEN rand5 < 93 THEN 'Denver' ELSE 'Boston' END AS city,
+  ELEMENT_AT(ARRAY('CA', 'TX', 'FL', 'NY', 'PA', 'IL', 'OH', 'GA', 'NC', 'MI', 'NJ', 'VA', 'WA', 'AZ', 'MA'),
+             CAST(rand4 * 15 DIV 100 AS INT) + 1) AS state,
+  ELEMENT_AT(ARRAY('Los Angeles', 'Houston', 'Phoenix', 'San Antonio', 'San Diego', 'Dallas', 'San Jose', 'Austin', 'Jacksonville', 'Fort Worth', 'Columbus', 'Charlotte', 'Seattle', 'Denver', 'Boston'),
+             CAST(rand5 * 15 DIV 100 AS INT) + 1) AS city,
   CAST(300 + (ABS(HASH(id, 7)) % 550) AS INT) AS credit_score,
   DATE_ADD('2023-01-01', CAST(ABS(HASH(id, 8)) % 730 AS INT)) AS registration_date
 FROM customer_ids
-""")
+""").cache()
+
+# Every downstream table reads customers from this cached view instead of rescanning the Delta table.
+# customer_id stays as the display key; the integer customer_id_int is the join and clustering key.
+customers_df.write.saveAsTable(f"{FQ}.customers")
+customers_df.createOrReplaceTempView("customers_src")
 
-count = spark.table(f"{catalog}.{schema}.customers").count()
+count = table_row_count("customers")
 print(f"✅ customers: {count:,} records")
 
+# Queries for the tables built from customers, written in parallel once all are defined
+table_queries = {}
+
 # COMMAND ----------
 
 # DBTITLE 1,2. Accounts Table (5,000 records)
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
-
-print("Creating accounts...")
-
-spark.sql(f"""
-CREATE TABLE {catalog}.{schema}.accounts AS
+table_queries["accounts"] = """
 WITH customer_base AS (
-  SELECT customer_id, CAST(SUBSTRING(customer_id, 5) AS BIGINT) AS id
-  FROM {catalog}.{schema}.customers
+  SELECT customer_id, customer_id_int AS id
+  FROM customers_src
+),
+account_rands AS (
+  SELECT customer_id, id,
+    ABS(HASH(id, 10)) % 100 AS plan_rand,
+    ABS(HASH(id, 14)) % 100 AS contract_rand,
+    ABS(HASH(id, 17)) % 100 AS payment_rand,
+    ABS(HASH(id, 26)) % 100 AS lines_rand
+  FROM customer_base
 )
 SELECT 
   CONCAT('ACC', LPAD(CAST(id AS STRING), 6, '0')) AS account_id,
-  customer_id,
-  CASE WHEN ABS(HASH(id, 10)) % 100 < 25 THEN 'Basic' WHEN ABS(HASH(id, 11)) % 100 < 60 THEN 'Standard'
-       WHEN ABS(HASH(id, 12)) % 100 < 85 THEN 'Premium' ELSE 'Unlimited' END AS plan_type,
+  customer_id, id AS customer_id_int,
+  CASE WHEN plan_rand < 25 THEN 'Basic' WHEN plan_rand < 60 THEN 'Standard'
+       WHEN plan_rand < 85 THEN 'Premium' ELSE 'Unlimited' END AS plan_type,
   ROUND(30 + ((ABS(HASH(id, 13)) % 10000) / 10000.0) * 120, 2) AS monthly_charge,
-  CASE WHEN ABS(HASH(id, 14)) % 100 < 50 THEN 'Month-to-Month' WHEN ABS(HASH(id, 15)) % 100 < 80 THEN 'One Year' ELSE 'Two Year' END AS contract_type,
+  CASE WHEN contract_rand < 50 THEN 'Month-to-Month' WHEN contract_rand < 80 THEN 'One Year' ELSE 'Two Year' END AS contract_type,
   CASE WHEN ABS(HASH(id, 16)) % 100 < 60 THEN TRUE ELSE FALSE END AS paperless_billing,
-  CASE WHEN ABS(HASH(id, 17)) % 100 < 40 THEN 'Credit Card' WHEN ABS(HASH(id, 18)) % 100 < 70 THEN 'Bank Transfer'
-       WHEN ABS(HASH(id, 19)) % 100 < 90 THEN 'Electronic Check' ELSE 'Mailed Check' END AS payment_method,
+  CASE WHEN payment_rand < 40 THEN 'Credit Card' WHEN payment_rand < 70 THEN 'Bank Transfer'
+       WHEN payment_rand < 90 THEN 'Electronic Check' ELSE 'Mailed Check' END AS payment_method,
   CASE WHEN ABS(HASH(id, 20)) % 100 < 65 THEN TRUE ELSE FALSE END AS autopay_enabled,
   CAST(1 + (ABS(HASH(id, 21)) % 71) AS INT) AS tenure_months,
   ROUND(100 + ((ABS(HASH(id, 22)) % 10000) / 10000.0) * 9900, 2) AS total_charges,
   CASE WHEN ABS(HASH(id, 23)) % 100 < 40 THEN TRUE ELSE FALSE END AS device_protection,
   CASE WHEN ABS(HASH(id, 24)) % 100 < 35 THEN TRUE ELSE FALSE END AS tech_support,
   CASE WHEN ABS(HASH(id, 25)) % 100 < 30 THEN TRUE ELSE FALSE END AS family_plan,
-  CASE WHEN ABS(HASH(id, 26)) % 100 < 40 THEN 1 WHEN ABS(HASH(id, 27)) % 100 < 70 THEN 2
-       WHEN ABS(HASH(id, 28)) % 100 < 85 THEN 3 WHEN ABS(HASH(id, 29)) % 100 < 95 THEN 4 ELSE 5 END AS num_lines
-FROM customer_base
-""")
-
-count = spark.table(f"{catalog}.{schema}.accounts").count()
-print(f"✅ accounts: {count:,} records")
+  CASE WHEN lines_rand < 40 THEN 1 WHEN lines_rand < 70 THEN 2
+       WHEN lines_rand < 85 THEN 3 WHEN lines_rand < 95 THEN 4 ELSE 5 END AS num_lines
+FROM account_rands
+"""
 
 # COMMAND ----------
 
 # DBTITLE 1,3. Usage Data (~65K records)
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
-
-print("Creating usage_data (this may take a minute)...")
-
-spark.sql(f"""
-CREATE TABLE {catalog}.{schema}.usage_data AS
+table_queries["usage_data"] = """
 WITH customer_base AS (
-  SELECT customer_id, CAST(SUBSTRING(customer_id, 5) AS BIGINT) AS id FROM {catalog}.{schema}.customers
+  SELECT customer_id, customer_id_int AS id FROM customers_src
 ),
 month_sequence AS (
   SELECT customer_id, id, month_offset,
     DATE_FORMAT(ADD_MONTHS(DATE_ADD('2023-01-01', CAST(ABS(HASH(id, 30)) % 300 AS INT)), month_offset), 'yyyy-MM') AS usage_month
   FROM customer_base
-  LATERAL VIEW EXPLODE(SEQUENCE(0, CAST(3 + (ABS(HASH(id, 31)) % 20) AS INT))) AS month_offset
-  WHERE month_offset <= 23
+  CROSS JOIN (SELECT CAST(id AS INT) AS month_offset FROM RANGE(0, 24)) months
+  WHERE month_offset <= 3 + (ABS(HASH(id, 31)) % 20)
 )
+-- IDs are derived from (id, month_offset) so no global sort is needed to number the rows
 SELECT 
-  CONCAT('USG', LPAD(CAST(ROW_NUMBER() OVER (ORDER BY customer_id, month_offset) AS STRING), 8, '0')) AS usage_id,
-  customer_id, usage_month,
+  CONCAT('USG', LPAD(CAST(id * 24 + month_offset + 1 AS STRING), 8, '0')) AS usage_id,
+  customer_id, id AS customer_id_int, usage_month,
   CAST(ABS(HASH(customer_id, usage_month, 1)) % 3000 AS INT) AS voice_minutes,
   CAST(ABS(HASH(customer_id, usage_month, 2)) % 1000 AS INT) AS sms_count,
   ROUND((ABS(HASH(customer_id, usage_month, 3)) % 10000) / 100.0, 2) AS data_usage_gb,
@@ -207,32 +216,24 @@ SELECT
   CAST(ABS(HASH(customer_id, usage_month, 6)) % 100 AS INT) AS international_calls,
   CAST(ABS(HASH(customer_id, usage_month, 7)) % 200 AS INT) AS peak_usage_hours
 FROM month_sequence
-""")
-
-count = spark.table(f"{catalog}.{schema}.usage_data").count()
-print(f"✅ usage_data: {count:,} records")
+"""
 
 # COMMAND ----------
 
 # DBTITLE 1,4. Support Tickets (~9K records)
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
-
-print("Creating support_tickets...")
-
-spark.sql(f"""
-CREATE TABLE {catalog}.{schema}.support_tickets AS
+table_queries["support_tickets"] = """
 WITH customer_sample AS (
-  SELECT customer_id, CAST(SUBSTRING(customer_id, 5) AS BIGINT) AS id
-  FROM {catalog}.{schema}.customers WHERE ABS(HASH(customer_id, 40)) % 100 < 60
+  SELECT customer_id, customer_id_int AS id
+  FROM customers_src WHERE ABS(HASH(customer_id, 40)) % 100 < 60
 ),
 ticket_sequence AS (
   SELECT customer_id, id, ticket_num
   FROM customer_sample
-  LATERAL VIEW EXPLODE(SEQUENCE(1, CAST(1 + (ABS(HASH(id, 41)) % 5) AS INT))) AS ticket_num
+  CROSS JOIN (SELECT CAST(id AS INT) AS ticket_num FROM RANGE(1, 6)) tickets
+  WHERE ticket_num <= 1 + (ABS(HASH(id, 41)) % 5)
 ),
 ticket_data AS (
-  SELECT ROW_NUMBER() OVER (ORDER BY customer_id, ticket_num) AS row_num,
+  SELECT id * 5 + ticket_num AS row_num,
     customer_id, ticket_num, id,
     ABS(HASH(id, ticket_num, 1)) % 100 AS type_rand,
     ABS(HASH(id, ticket_num, 2)) % 100 AS priority_rand,
@@ -245,7 +246,7 @@ ticket_data AS (
   FROM ticket_sequence
 )
 SELECT 
-  CONCAT('TKT', LPAD(CAST(row_num AS STRING), 7, '0')) AS ticket_id, customer_id,
+  CONCAT('TKT', LPAD(CAST(row_num AS STRING), 7, '0')) AS ticket_id, customer_id, id AS customer_id_int,
   CASE WHEN type_rand < 12 THEN 'Technical Issue' WHEN type_rand < 25 THEN 'Billing Question'
        WHEN type_rand < 37 THEN 'Service Outage' WHEN type_rand < 50 THEN 'Plan Change Request'
        WHEN type_rand < 62 THEN 'Device Support' WHEN type_rand < 75 THEN 'Network Quality'
@@ -258,70 +259,59 @@ SELECT
   CASE WHEN satisfaction_rand > 30 THEN CAST(1 + (satisfaction_rand % 5) AS INT) ELSE NULL END AS satisfaction_score,
   CASE WHEN escalated_rand < 20 THEN TRUE ELSE FALSE END AS escalated
 FROM ticket_data
-""")
-
-count = spark.table(f"{catalog}.{schema}.support_tickets").count()
-print(f"✅ support_tickets: {count:,} records")
+"""
 
 # COMMAND ----------
 
 # DBTITLE 1,5. Billing Payments (~75K records)
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
-
-print("Creating billing_payments...")
-
-spark.sql(f"""
-CREATE TABLE {catalog}.{schema}.billing_payments AS
+table_queries["billing_payments"] = """
 WITH customer_base AS (
-  SELECT customer_id, CAST(SUBSTRING(customer_id, 5) AS BIGINT) AS id FROM {catalog}.{schema}.customers
+  SELECT customer_id, customer_id_int AS id FROM customers_src
 ),
 payment_sequence AS (
   SELECT customer_id, id, payment_num,
     DATE_ADD(DATE_ADD('2023-01-01', CAST(ABS(HASH(id, 50)) % 300 AS INT)), payment_num * 30) AS payment_date
   FROM customer_base
-  LATERAL VIEW EXPLODE(SEQUENCE(0, CAST(6 + (ABS(HASH(id, 51)) % 18) AS INT))) AS payment_num
-  WHERE payment_num <= 23
+  CROSS JOIN (SELECT CAST(id AS INT) AS payment_num FROM RANGE(0, 24)) payments
+  WHERE payment_num <= 6 + (ABS(HASH(id, 51)) % 18)
+),
+payment_data AS (
+  SELECT customer_id, id, payment_num, payment_date,
+    ABS(HASH(customer_id, payment_date, 2)) % 100 AS status_rand,
+    ABS(HASH(customer_id, payment_date, 3)) % 100 AS late_rand,
+    ABS(HASH(customer_id, payment_date, 5)) % 100 AS method_rand
+  FROM payment_sequence
 )
 SELECT 
-  CONCAT('PAY', LPAD(CAST(ROW_NUMBER() OVER (ORDER BY customer_id, payment_num) AS STRING), 8, '0')) AS payment_id,
-  customer_id, payment_date,
+  CONCAT('PAY', LPAD(CAST(id * 24 + payment_num + 1 AS STRING), 8, '0')) AS payment_id,
+  customer_id, id AS customer_id_int, payment_date,
   ROUND(30 + ((ABS(HASH(customer_id, payment_date, 1)) % 10000) / 10000.0) * 120, 2) AS amount,
-  CASE WHEN ABS(HASH(customer_id, payment_date, 2)) % 100 < 5 THEN 'Failed' ELSE 'Success' END AS payment_status,
-  CASE WHEN ABS(HASH(customer_id, payment_date, 3)) % 100 < 10 AND ABS(HASH(customer_id, payment_date, 2)) % 100 >= 5 THEN TRUE ELSE FALSE END AS late_payment,
-  CASE WHEN ABS(HASH(customer_id, payment_date, 3)) % 100 < 10 AND ABS(HASH(customer_id, payment_date, 2)) % 100 >= 5
+  CASE WHEN status_rand < 5 THEN 'Failed' ELSE 'Success' END AS payment_status,
+  CASE WHEN late_rand < 10 AND status_rand >= 5 THEN TRUE ELSE FALSE END AS late_payment,
+  CASE WHEN late_rand < 10 AND status_rand >= 5
        THEN CAST(1 + (ABS(HASH(customer_id, payment_date, 4)) % 30) AS INT) ELSE 0 END AS days_late,
-  CASE WHEN ABS(HASH(customer_id, payment_date, 5)) % 100 < 40 THEN 'Credit Card' WHEN ABS(HASH(customer_id, payment_date, 5)) % 100 < 70 THEN 'Bank Transfer' ELSE 'Electronic Check' END AS payment_method
-FROM payment_sequence
-""")
-
-count = spark.table(f"{catalog}.{schema}.billing_payments").count()
-print(f"✅ billing_payments: {count:,} records")
+  CASE WHEN method_rand < 40 THEN 'Credit Card' WHEN method_rand < 70 THEN 'Bank Transfer' ELSE 'Electronic Check' END AS payment_method
+FROM payment_data
+"""
 
 # COMMAND ----------
 
 # DBTITLE 1,6. Network Quality (~179K records)
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
-
-print("Creating network_quality (this may take a minute)...")
-
-spark.sql(f"""
-CREATE TABLE {catalog}.{schema}.network_quality AS
+table_queries["network_quality"] = """
 WITH customer_sample AS (
-  SELECT customer_id, CAST(SUBSTRING(customer_id, 5) AS BIGINT) AS id
-  FROM {catalog}.{schema}.customers WHERE ABS(HASH(customer_id, 60)) % 100 < 80
+  SELECT customer_id, customer_id_int AS id
+  FROM customers_src WHERE ABS(HASH(customer_id, 60)) % 100 < 80
 ),
 week_sequence AS (
   SELECT customer_id, id, week_num,
     DATE_ADD(DATE_ADD('2023-01-01', CAST(ABS(HASH(id, 61)) % 300 AS INT)), week_num * 7) AS measurement_date
   FROM customer_sample
-  LATERAL VIEW EXPLODE(SEQUENCE(0, CAST(10 + (ABS(HASH(id, 62)) % 70) AS INT))) AS week_num
-  WHERE week_num <= 79
+  CROSS JOIN (SELECT CAST(id AS INT) AS week_num FROM RANGE(0, 80)) weeks
+  WHERE week_num <= 10 + (ABS(HASH(id, 62)) % 70)
 )
 SELECT 
-  CONCAT('QUA', LPAD(CAST(ROW_NUMBER() OVER (ORDER BY customer_id, week_num) AS STRING), 8, '0')) AS quality_id,
-  customer_id, measurement_date,
+  CONCAT('QUA', LPAD(CAST(id * 80 + week_num + 1 AS STRING), 8, '0')) AS quality_id,
+  customer_id, id AS customer_id_int, measurement_date,
   ROUND(10 + ((ABS(HASH(customer_id, measurement_date, 1)) % 10000) / 10000.0) * 190, 2) AS avg_download_speed_mbps,
   ROUND(5 + ((ABS(HASH(customer_id, measurement_date, 2)) % 10000) / 10000.0) * 45, 2) AS avg_upload_speed_mbps,
   ROUND(-110 + ((ABS(HASH(customer_id, measurement_date, 3)) % 10000) / 10000.0) * 60, 2) AS signal_strength,
@@ -330,25 +320,43 @@ SELECT
   ROUND(10 + ((ABS(HASH(customer_id, measurement_date, 6)) % 10000) / 10000.0) * 140, 2) AS latency_ms,
   ROUND(0.5 + ((ABS(HASH(customer_id, measurement_date, 7)) % 10000) / 10000.0) * 14.5, 2) AS tower_distance_km
 FROM week_sequence
-""")
+"""
+
+# COMMAND ----------
 
-count = spark.table(f"{catalog}.{schema}.network_quality").count()
-print(f"✅ network_quality: {count:,} records")
+# DBTITLE 1,Write Tables 2-6 in Parallel
+from concurrent.futures import ThreadPoolExecutor
+
+# Date columns Genie filters on, indexed for data skipping alongside customer_id_int
+skipping_columns = {
+    'accounts': [],
+    'usage_data': ['usage_month'],
+    'support_tickets': ['created_date'],
+    'billing_payments': ['payment_date'],
+    'network_quality': ['measurement_date'],
+}
+
+def create_table(table):
+    """Write one table from its query; Databricks' FAIR scheduler interleaves the concurrent jobs"""
+    spark.sql(f"{clustered_table_ddl(table, *skipping_columns[table])}\n{table_queries[table]}")
+    return table, table_row_count(table)
+
+print(f"Creating {', '.join(table_queries)} (this may take a minute)...")
+
+with ThreadPoolExecutor(max_workers=len(table_queries)) as executor:
+    for table, count in executor.map(create_table, table_queries):
+        print(f"✅ {table}: {count:,} records")
 
 # COMMAND ----------
 
 # DBTITLE 1,7. Churn Labels (5,000 records)
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
-
 print("Creating churn_labels...")
 
-spark.sql(f"""
-CREATE TABLE {catalog}.{schema}.churn_labels AS
+spark.sql(f"""{clustered_table_ddl("churn_labels", "churn_date")}
 WITH customer_accounts AS (
   SELECT c.customer_id, a.account_id, a.contract_type, a.tenure_months, a.monthly_charge, a.autopay_enabled,
-    CAST(SUBSTRING(c.customer_id, 5) AS BIGINT) AS id
-  FROM {catalog}.{schema}.customers c JOIN {catalog}.{schema}.accounts a ON c.customer_id = a.customer_id
+    c.customer_id_int AS id
+  FROM customers_src c JOIN {FQ}.accounts a ON c.customer_id_int = a.customer_id_int
 ),
 churn_probabilities AS (
   SELECT customer_id, account_id, id,
@@ -362,80 +370,94 @@ churn_probabilities AS (
 ),
 churn_outcomes AS (
   SELECT customer_id, account_id, id, churn_probability,
-    CASE WHEN (ABS(HASH(id, 70)) % 10000) / 10000.0 < churn_probability THEN 1 ELSE 0 END AS churned
+    CASE WHEN (ABS(HASH(id, 70)) % 10000) / 10000.0 < churn_probability THEN 1 ELSE 0 END AS churned,
+    ABS(HASH(id, 72)) % 100 AS reason_rand
   FROM churn_probabilities
 )
-SELECT customer_id, account_id, churned,
+SELECT customer_id, id AS customer_id_int, account_id, churned,
   CASE WHEN churned = 1 THEN DATE_SUB('2024-10-31', CAST(1 + (ABS(HASH(id, 71)) % 180) AS INT)) ELSE NULL END AS churn_date,
   CASE WHEN churned = 1 THEN
-    CASE WHEN ABS(HASH(id, 72)) % 100 < 14 THEN 'Competitor Offer' WHEN ABS(HASH(id, 73)) % 100 < 29 THEN 'Price Too High'
-         WHEN ABS(HASH(id, 74)) % 100 < 43 THEN 'Poor Service Quality' WHEN ABS(HASH(id, 75)) % 100 < 57 THEN 'Moved to Different Area'
-         WHEN ABS(HASH(id, 76)) % 100 < 71 THEN 'Dissatisfied with Support' WHEN ABS(HASH(id, 77)) % 100 < 86 THEN 'Found Better Plan'
+    CASE WHEN reason_rand < 14 THEN 'Competitor Offer' WHEN reason_rand < 29 THEN 'Price Too High'
+         WHEN reason_rand < 43 THEN 'Poor Service Quality' WHEN reason_rand < 57 THEN 'Moved to Different Area'
+         WHEN reason_rand < 71 THEN 'Dissatisfied with Support' WHEN reason_rand < 86 THEN 'Found Better Plan'
          ELSE 'Network Issues' END
   ELSE NULL END AS churn_reason,
   ROUND(churn_probability * 100, 2) AS churn_probability_score
 FROM churn_outcomes
 """)
 
-count = spark.table(f"{catalog}.{schema}.churn_labels").count()
+count = table_row_count("churn_labels")
 print(f"✅ churn_labels: {count:,} records")
 
+# churn_labels was the last reader of customers_src
+customers_df.unpersist()
+
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ## Step 4: Create Views
+# MAGIC ## Step 4: Create customer_360 and Views
+# MAGIC
+# MAGIC `customer_360` is materialized as a Delta table so churn-risk queries don't re-run its 3-way join.
 
 # COMMAND ----------
 
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
+print("Creating customer_360 table and views...")
 
-print("Creating views...")
+# These only read tables, so their DDL is submitted together
+ddl_statements = []
 
 # Customer Support Summary
-spark.sql(f"""
-CREATE VIEW {catalog}.{schema}.customer_support_summary AS
-SELECT customer_id, COUNT(*) as total_tickets, AVG(satisfaction_score) as avg_satisfaction,
-  SUM(CASE WHEN status = 'Open' THEN 1 ELSE 0 END) as open_tickets,
-  SUM(CASE WHEN status = 'Closed' THEN 1 ELSE 0 END) as closed_tickets,
+ddl_statements.append(f"""
+CREATE VIEW {FQ}.customer_support_summary AS
+SELECT customer_id, customer_id_int, COUNT(*) as total_tickets, AVG(satisfaction_score) as avg_satisfaction,
+  COUNT(*) FILTER (WHERE status = 'Open') as open_tickets,
+  COUNT(*) FILTER (WHERE status = 'Closed') as closed_tickets,
   AVG(resolution_time_days) as avg_resolution_days,
-  SUM(CASE WHEN escalated THEN 1 ELSE 0 END) as escalated_tickets
-FROM {catalog}.{schema}.support_tickets GROUP BY customer_id
+  COUNT(*) FILTER (WHERE escalated) as escalated_tickets
+FROM {FQ}.support_tickets GROUP BY customer_id, customer_id_int
 """)
 
 # Latest Usage
-spark.sql(f"""
-CREATE VIEW {catalog}.{schema}.latest_usage AS
+ddl_statements.append(f"""
+CREATE VIEW {FQ}.latest_usage AS
 SELECT customer_id, MAX(usage_month) as latest_month,
   AVG(voice_minutes) as avg_voice_minutes, AVG(sms_count) as avg_sms_count,
   AVG(data_usage_gb) as avg_data_usage_gb, AVG(roaming_charges) as avg_roaming_charges,
   AVG(overage_charges) as avg_overage_charges
-FROM {catalog}.{schema}.usage_data GROUP BY customer_id
+FROM {FQ}.usage_data GROUP BY customer_id
 """)
 
-# Customer 360
-spark.sql(f"""
-CREATE VIEW {catalog}.{schema}.customer_360 AS
-SELECT c.customer_id, c.first_name, c.last_name, c.age, c.gender, c.state, c.city, c.credit_score,
+# Customer 360 (table clustered on the churn-risk filter columns)
+ddl_statements.append(f"""
+CREATE TABLE {FQ}.customer_360
+CLUSTER BY (churned, churn_probability_score)
+TBLPROPERTIES ('delta.autoOptimize.optimizeWrite' = 'true')
+AS
+SELECT /*+ BROADCAST(a, cl) */ c.customer_id, c.customer_id_int, c.first_name, c.last_name, c.age, c.gender, c.state, c.city, c.credit_score,
   a.plan_type, a.monthly_charge, a.contract_type, a.tenure_months, a.autopay_enabled,
   cl.churned, cl.churn_probability_score, cl.churn_reason
-FROM {catalog}.{schema}.customers c 
-JOIN {catalog}.{schema}.accounts a ON c.customer_id = a.customer_id
-JOIN {catalog}.{schema}.churn_labels cl ON c.customer_id = cl.customer_id
+FROM {FQ}.customers c 
+JOIN {FQ}.accounts a ON c.customer_id_int = a.customer_id_int
+JOIN {FQ}.churn_labels cl ON c.customer_id_int = cl.customer_id_int
 """)
 
-# High Risk Customers
+with ThreadPoolExecutor(max_workers=len(ddl_statements)) as executor:
+    list(executor.map(spark.sql, ddl_statements))
+
+spark.sql(f"OPTIMIZE {FQ}.customer_360")
+
+# High Risk Customers (built on customer_360 and customer_support_summary, so created last)
 spark.sql(f"""
-CREATE VIEW {catalog}.{schema}.high_risk_customers AS
-SELECT cv.customer_id, cv.first_name, cv.last_name, cv.plan_type, cv.monthly_charge,
+CREATE VIEW {FQ}.high_risk_customers AS
+SELECT /*+ BROADCAST(css) */ cv.customer_id, cv.first_name, cv.last_name, cv.plan_type, cv.monthly_charge,
   cv.tenure_months, cv.churn_probability_score, css.total_tickets, css.avg_satisfaction
-FROM {catalog}.{schema}.customer_360 cv
-LEFT JOIN {catalog}.{schema}.customer_support_summary css ON cv.customer_id = css.customer_id
+FROM {FQ}.customer_360 cv
+LEFT JOIN {FQ}.customer_support_summary css ON cv.customer_id_int = css.customer_id_int
 WHERE cv.churned = 0 AND cv.churn_probability_score > 60
 ORDER BY cv.churn_probability_score DESC
 """)
 
-print("✅ All 4 views created")
+print("✅ customer_360 table and 3 views created")
 
 # COMMAND ----------
 
@@ -444,26 +466,24 @@ print("✅ All 4 views created")
 
 # COMMAND ----------
 
-catalog = dbutils.widgets.get("catalog_name")
-schema = dbutils.widgets.get("schema_name")
+# Get counts from the Delta log of all tables, plus the churned total, in a single job
+from functools import reduce
 
-# Get counts
-counts = {}
-for table in ['customers', 'accounts', 'usage_data', 'support_tickets', 'billing_payments', 'network_quality', 'churn_labels']:
-    counts[table] = spark.table(f"{catalog}.{schema}.{table}").count()
+tables = ['customers', 'accounts', 'usage_data', 'support_tickets', 'billing_payments', 'network_quality', 'churn_labels']
+churned_total = spark.sql(f"SELECT 'churned' AS table, CAST(SUM(churned) AS BIGINT) AS num_records FROM {FQ}.churn_labels")
+metrics = reduce(lambda a, b: a.unionByName(b), [creation_metrics(table) for table in tables] + [churned_total])
+records = {row["table"]: row["num_records"] for row in metrics.collect()}
+counts = {table: records[table] for table in tables}
 
 # Get churn stats
-churn_stats = spark.sql(f"""
-  SELECT COUNT(*) as total, SUM(churned) as churned,
-    ROUND(100.0 * SUM(churned) / COUNT(*), 2) as churn_rate
-  FROM {catalog}.{schema}.churn_labels
-""").collect()[0]
+churn_stats = {'total': counts['churn_labels'], 'churned': records['churned']}
+churn_stats['churn_rate'] = round(100.0 * churn_stats['churned'] / churn_stats['total'], 2)
 
 # Display summary
 print("="*70)
 print("🎉 SETUP COMPLETE!")
 print("="*70)
-print(f"\n📍 Location: {catalog}.{schema}")
+print(f"\n📍 Location: {FQ}")
 print(f"\n📊 Tables Created:")
 for table, count in counts.items():
     print(f"   {table}: {count:,}")
@@ -477,6 +497,6 @@ print("\n"+"="*70)
 print("🚀 NEXT STEPS:")
 print("="*70)
 print(f"1. Create a Genie Space")
-print(f"2. Point it to: {catalog}.{schema}")
+print(f"2. Point it to: {FQ}")
 print(f"3. Test with: 'What's the churn rate by plan type?'")
 print("="*70)
\ No newline at end of file
@@ -6,6 +6,8 @@ from databricks.sdk.service.serving import (
     AiGatewayRateLimitRenewalPeriod
 )
 import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,32 +17,33 @@ logger = logging.getLogger(__name__)
 w = WorkspaceClient()
 
 # Define approved foundation models (using endpoint names)
-APPROVED_MODELS = [
+APPROVED_MODELS = frozenset({
     "databricks-meta-llama-3-1-70b-instruct",
     "databricks-meta-llama-3-1-405b-instruct",
     "databricks-claude-sonnet-4",
     # Add other approved foundation model endpoint names here
-]
+})
 
-def is_foundation_model_endpoint(endpoint):
-    """
-    Check if an endpoint is a foundation model endpoint.
-    Foundation model endpoints have names starting with 'databricks-'.
-    """
-    try:
-        # Check the endpoint name itself
-        if endpoint.name and endpoint.name.startswith('databricks-'):
-            return True, endpoint.name
-        return False, None
-    except Exception as e:
-        logger.warning(f"Error checking endpoint {endpoint.name}: {e}")
-        return False, None
+# Number of endpoints processed concurrently (each update is a control-plane round trip)
+MAX_WORKERS = 16
 
 def set_ai_gateway_rate_limit_to_zero(endpoint_name):
     """
     Enable AI Gateway and set rate limits to zero for a foundation model endpoint.
     """
     try:
+        # Skip the update if the endpoint is already restricted, so re-runs only read.
+        # Only an endpoint-wide zero limit counts: a zero limit scoped to a user, group or
+        # service principal leaves the endpoint open to everyone else
+        current = w.serving_endpoints.get(endpoint_name)
+        gateway = current.ai_gateway
+        if gateway and any(
+            rl.key == AiGatewayRateLimitKey.ENDPOINT and not rl.principal and rl.calls == 0
+            for rl in gateway.rate_limits or []
+        ):
+            logger.info(f"✓ AI Gateway rate limits already zero for {endpoint_name} - no update needed")
+            return True
+        
         logger.info(f"Setting AI Gateway rate limits to zero for endpoint: {endpoint_name}")
         
         # Configure AI Gateway with rate limits set to zero at the endpoint level
@@ -99,46 +102,50 @@ def ensure_ai_gateway_enabled(endpoint_name):
         logger.error(f"Error checking AI Gateway for {endpoint_name}: {e}")
         return False
 
+def process_endpoint(endpoint):
+    """
+    Restrict or verify a single endpoint.
+    Returns a (status, endpoint_name) tuple, status being 'approved', 'restricted', 'error' or 'skipped'.
+    """
+    name = endpoint.name
+    logger.info(f"\nProcessing endpoint: {name}")
+    
+    # Foundation model endpoints have names starting with 'databricks-'
+    if not (name and name.startswith('databricks-')):
+        logger.info(f"  → Skipping {name} (not a foundation model endpoint)")
+        return "skipped", name
+    
+    logger.info(f"  → Found foundation model endpoint: {name}")
+    
+    # Check if model is in approved list
+    if name in APPROVED_MODELS:
+        logger.info(f"  ✓ {name} is APPROVED - skipping restriction")
+        ok = ensure_ai_gateway_enabled(name)
+        return ("approved" if ok else "error"), name
+    
+    logger.warning(f"  ✗ {name} is NOT APPROVED - setting rate limits to zero")
+    ok = set_ai_gateway_rate_limit_to_zero(name)
+    return ("restricted" if ok else "error"), name
+
 def main():
     """
     Main function to iterate through all endpoints and restrict non-approved foundation models.
     """
     logger.info("Starting foundation model endpoint restriction process using AI Gateway...")
-    logger.info(f"Approved models: {APPROVED_MODELS}")
+    logger.info(f"Approved models: {sorted(APPROVED_MODELS)}")
     logger.info("=" * 60)
     
-    restricted_count = 0
-    approved_count = 0
-    error_count = 0
-    
     try:
-        # List all serving endpoints
-        endpoints = w.serving_endpoints.list()
+        # List all serving endpoints, then process them concurrently
+        endpoints = list(w.serving_endpoints.list())
+        
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = list(executor.map(process_endpoint, endpoints))
         
-        for endpoint in endpoints:
-            logger.info(f"\nProcessing endpoint: {endpoint.name}")
-            
-            # Check if it's a foundation model endpoint
-            is_fm, model_name = is_foundation_model_endpoint(endpoint)
-            
-            if is_fm:
-                logger.info(f"  → Found foundation model endpoint: {endpoint.name}")
-                
-                # Check if model is in approved list
-                if model_name in APPROVED_MODELS:
-                    logger.info(f"  ✓ Model is APPROVED - skipping restriction")
-                    if ensure_ai_gateway_enabled(endpoint.name):
-                        approved_count += 1
-                    else:
-                        error_count += 1
-                else:
-                    logger.warning(f"  ✗ Model is NOT APPROVED - setting rate limits to zero")
-                    if set_ai_gateway_rate_limit_to_zero(endpoint.name):
-                        restricted_count += 1
-                    else:
-                        error_count += 1
-            else:
-                logger.info(f"  → Skipping (not a foundation model endpoint)")
+        status_counts = Counter(status for status, _ in results)
+        restricted_count = status_counts["restricted"]
+        approved_count = status_counts["approved"]
+        error_count = status_counts["error"]
         
         # Summary
         logger.info("\n" + "=" * 60)
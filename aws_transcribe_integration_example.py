@@ -10,7 +10,7 @@ This notebook demonstrates how to integrate AWS Transcribe with Databricks for a
 
 # COMMAND ----------
 
-%pip install boto3
+%pip install boto3 aioboto3
 dbutils.library.restartPython()
 
 # COMMAND ----------
@@ -20,12 +20,17 @@ dbutils.library.restartPython()
 
 # COMMAND ----------
 
+import aioboto3
+import asyncio
 import boto3
-import json
+import hashlib
 import time
-import requests
+from aiobotocore.config import AioConfig
+from botocore.config import Config
+from botocore.exceptions import WaiterError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pyspark.sql.functions import *
+from pyspark.sql.functions import col, current_timestamp, lit
 from pyspark.sql.types import *
 
 # COMMAND ----------
@@ -51,6 +56,10 @@ catalog = "communications"
 schema = "transcriptions"
 raw_table = f"{catalog}.{schema}.raw_transcriptions"
 processed_table = f"{catalog}.{schema}.call_transcripts"
+jobs_table = f"{catalog}.{schema}.transcription_jobs"
+
+# Auto Loader checkpoint for ingesting the Transcribe output bucket
+checkpoint_path = f"/Volumes/{catalog}/{schema}/pipeline/raw_transcriptions_checkpoint"
 
 # COMMAND ----------
 
@@ -59,19 +68,30 @@ processed_table = f"{catalog}.{schema}.call_transcripts"
 
 # COMMAND ----------
 
+# Shared client config: adaptive retries back off and retry on throttling (e.g. LimitExceededException)
+# instead of failing the call, and the connection pool is sized for the worker threads below
+# (urllib3 keeps 10 by default) so concurrent calls reuse kept-alive connections
+aws_client_config = Config(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    max_pool_connections=50,
+    tcp_keepalive=True
+)
+
 # Initialize boto3 clients
 s3_client = boto3.client(
     's3',
     aws_access_key_id=aws_access_key,
     aws_secret_access_key=aws_secret_key,
-    region_name=aws_region
+    region_name=aws_region,
+    config=aws_client_config
 )
 
 transcribe_client = boto3.client(
     'transcribe',
     aws_access_key_id=aws_access_key,
     aws_secret_access_key=aws_secret_key,
-    region_name=aws_region
+    region_name=aws_region,
+    config=aws_client_config
 )
 
 print("✓ AWS clients initialized successfully")
@@ -80,7 +100,7 @@ print("✓ AWS clients initialized successfully")
 
 %md
 ### Create Database Schema
-Create the catalog and schema if they don't exist
+Create the catalog, schema, job log table and checkpoint volume if they don't exist
 
 # COMMAND ----------
 
@@ -88,6 +108,9 @@ Create the catalog and schema if they don't exist
 CREATE CATALOG IF NOT EXISTS communications;
 USE CATALOG communications;
 CREATE SCHEMA IF NOT EXISTS transcriptions;
+USE SCHEMA transcriptions;
+CREATE TABLE IF NOT EXISTS transcription_jobs (job_name STRING, file_key STRING, file_name STRING, submit_time TIMESTAMP);
+CREATE VOLUME IF NOT EXISTS pipeline;
 
 # COMMAND ----------
 
@@ -97,49 +120,83 @@ Find audio files in S3 that haven't been transcribed yet
 
 # COMMAND ----------
 
+# Audio file extensions accepted by AWS Transcribe
+_AUDIO_EXTS = frozenset({'mp3', 'mp4', 'wav', 'flac', 'm4a', 'ogg', 'webm'})
+
+def list_prefix(prefix):
+    """List every object under a prefix, following pagination"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    objects = []
+    for page in paginator.paginate(Bucket=audio_bucket, Prefix=prefix, PaginationConfig={'PageSize': 1000}):
+        objects.extend(page.get('Contents', []))
+    return objects
+
+def list_audio_objects(max_workers=8):
+    """List all objects under audio_prefix, walking each sub-prefix (e.g. date folders) concurrently"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    objects = []
+    sub_prefixes = []
+    for page in paginator.paginate(Bucket=audio_bucket, Prefix=audio_prefix, Delimiter='/', PaginationConfig={'PageSize': 1000}):
+        objects.extend(page.get('Contents', []))
+        sub_prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+    
+    if sub_prefixes:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for prefix_objects in executor.map(list_prefix, sub_prefixes):
+                objects.extend(prefix_objects)
+    
+    return objects
+
 def get_unprocessed_audio_files():
     """Get list of audio files from S3 that haven't been processed yet"""
     
-    # List objects in S3
-    response = s3_client.list_objects_v2(
-        Bucket=audio_bucket,
-        Prefix=audio_prefix
-    )
-    
     audio_files = []
-    if 'Contents' in response:
-        for obj in response['Contents']:
-            key = obj['Key']
-            # Filter for audio files
-            if key.endswith(('.mp3', '.mp4', '.wav', '.flac', '.m4a', '.ogg', '.webm')):
-                audio_files.append({
-                    'file_key': key,
-                    'file_name': key.split('/')[-1],
-                    'size_bytes': obj['Size'],
-                    'last_modified': obj['LastModified']
-                })
+    for obj in list_audio_objects():
+        key = obj['Key']
+        # Filter for audio files
+        if key.rsplit('.', 1)[-1].lower() in _AUDIO_EXTS:
+            audio_files.append({
+                'file_key': key,
+                'file_name': key.rpartition('/')[-1],
+                'etag': obj['ETag'],
+                'size_bytes': obj['Size'],
+                'last_modified': obj['LastModified']
+            })
     
     if not audio_files:
         print("No audio files found in S3")
-        return spark.createDataFrame([], schema="file_key STRING, file_name STRING, size_bytes LONG, last_modified TIMESTAMP")
-    
-    # Create DataFrame
-    files_df = spark.createDataFrame(audio_files)
+        return []
     
     # Check against already processed files (if table exists)
     try:
-        processed_df = spark.table(raw_table).select("file_key").distinct()
-        unprocessed_df = files_df.join(processed_df, "file_key", "left_anti")
-        print(f"Found {unprocessed_df.count()} unprocessed audio files")
+        # Only look up the listed keys so Delta can skip files instead of reading the whole table
+        new_keys = [f['file_key'] for f in audio_files]
+        processed_keys = {
+            r.file_key
+            for r in spark.table(raw_table).where(col("file_key").isin(new_keys)).select("file_key").distinct().collect()
+        }
+        unprocessed = [f for f in audio_files if f['file_key'] not in processed_keys]
+        print(f"Found {len(unprocessed)} unprocessed audio files")
     except:
         # Table doesn't exist yet, all files are unprocessed
-        unprocessed_df = files_df
-        print(f"Found {unprocessed_df.count()} audio files (no existing transcriptions table)")
+        unprocessed = audio_files
+        print(f"Found {len(unprocessed)} audio files (no existing transcriptions table)")
     
-    return unprocessed_df
+    return unprocessed
+
+audio_files_schema = StructType([
+    StructField("file_key", StringType(), False),
+    StructField("file_name", StringType(), False),
+    StructField("etag", StringType(), True),
+    StructField("size_bytes", LongType(), True),
+    StructField("last_modified", TimestampType(), True)
+])
 
 unprocessed_files = get_unprocessed_audio_files()
-display(unprocessed_files)
+
+# Nothing new is the common case for scheduled runs; don't start a Spark job just to display an empty list
+if unprocessed_files:
+    display(spark.createDataFrame(unprocessed_files, schema=audio_files_schema))
 
 # COMMAND ----------
 
@@ -149,29 +206,59 @@ Submit async transcription jobs for each unprocessed audio file
 
 # COMMAND ----------
 
-def start_transcribe_job(file_key, file_name):
+# StartTranscriptionJob is limited to 50 TPS per account; stay below it
+submit_rate_per_second = 40
+submit_concurrency = 25
+
+# Map file extensions to Transcribe media formats
+_FORMAT_MAPPING = {
+    'mp3': 'mp3',
+    'mp4': 'mp4',
+    'wav': 'wav',
+    'flac': 'flac',
+    'm4a': 'mp4',
+    'ogg': 'ogg',
+    'webm': 'webm'
+}
+
+class RateLimiter:
+    """Token bucket pacing the submissions on the event loop"""
+    
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+    
+    async def acquire(self):
+        """Take one token, sleeping until it is available"""
+        # No await before the token is taken, so concurrent coroutines can't interleave here
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0
+        self.tokens -= 1
+        if wait:
+            await asyncio.sleep(wait)
+
+submit_limiter = RateLimiter(submit_rate_per_second)
+
+def run_async(coro):
+    """Run a coroutine to completion, even when the notebook already has an event loop running"""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+async def start_transcribe_job(client, file_key, file_name, etag):
     """Start an AWS Transcribe job for a single audio file"""
     
-    # Create unique job name
-    job_name = f"transcribe_{file_name.replace('.', '_').replace(' ', '_')}_{int(time.time())}"
+    # Job name is stable for a given object version, so a retried batch can't transcribe the same audio twice
+    job_name = 'tx_' + hashlib.sha1((etag + file_key).encode()).hexdigest()[:32]
     media_uri = f"s3://{audio_bucket}/{file_key}"
     
-    # Get file format
-    file_format = file_name.split('.')[-1].lower()
-    # Map file extensions to Transcribe formats
-    format_mapping = {
-        'mp3': 'mp3',
-        'mp4': 'mp4',
-        'wav': 'wav',
-        'flac': 'flac',
-        'm4a': 'mp4',
-        'ogg': 'ogg',
-        'webm': 'webm'
-    }
-    media_format = format_mapping.get(file_format, 'mp3')
+    media_format = _FORMAT_MAPPING.get(file_name.rsplit('.', 1)[-1].lower(), 'mp3')
     
-    try:
-        response = transcribe_client.start_transcription_job(
+    async def submit():
+        await submit_limiter.acquire()
+        await client.start_transcription_job(
             TranscriptionJobName=job_name,
             Media={'MediaFileUri': media_uri},
             MediaFormat=media_format,
@@ -184,10 +271,25 @@ def start_transcribe_job(file_key, file_name):
                 'ShowAlternatives': False
             }
         )
+    
+    try:
+        try:
+            await submit()
+            status = 'SUBMITTED'
+        except client.exceptions.ConflictException:
+            # A job with this name already exists, i.e. this file was submitted by an earlier run
+            response = await client.get_transcription_job(TranscriptionJobName=job_name)
+            if response['TranscriptionJob']['TranscriptionJobStatus'] == 'FAILED':
+                # Free the name and retry, otherwise a failed file would be blocked forever
+                await client.delete_transcription_job(TranscriptionJobName=job_name)
+                await submit()
+                status = 'SUBMITTED'
+            else:
+                status = 'ALREADY_SUBMITTED'  # queued, in progress or completed: poll it like a new job
         
         return {
             'job_name': job_name,
-            'status': 'SUBMITTED',
+            'status': status,
             'file_key': file_key,
             'file_name': file_name,
             'media_uri': media_uri,
@@ -203,29 +305,73 @@ def start_transcribe_job(file_key, file_name):
             'submit_time': datetime.now()
         }
 
+async def submit_all(files):
+    """Submit one transcription job per file concurrently on a single event loop"""
+    session = aioboto3.Session(
+        aws_access_key_id=aws_access_key,
+        aws_secret_access_key=aws_secret_key,
+        region_name=aws_region
+    )
+    semaphore = asyncio.Semaphore(submit_concurrency)
+    
+    # One pooled connection per in-flight submission (aiobotocore keeps 10 by default)
+    client_config = AioConfig(retries={'mode': 'standard', 'max_attempts': 10}, max_pool_connections=submit_concurrency)
+    async with session.client('transcribe', config=client_config) as client:
+        async def submit_one(f):
+            async with semaphore:
+                return await start_transcribe_job(client, f['file_key'], f['file_name'], f['etag'])
+        
+        return await asyncio.gather(*[submit_one(f) for f in files])
+
+# Explicit schema so Spark doesn't infer one from the job dicts (failed jobs have no media_uri, successful ones no error)
+submitted_jobs_schema = StructType([
+    StructField("job_name", StringType(), False),
+    StructField("status", StringType(), False),
+    StructField("file_key", StringType(), True),
+    StructField("file_name", StringType(), True),
+    StructField("media_uri", StringType(), True),
+    StructField("error", StringType(), True),
+    StructField("submit_time", TimestampType(), True)
+])
+
 # Submit jobs for all unprocessed files
 submitted_jobs = []
-file_count = unprocessed_files.count()
+file_count = len(unprocessed_files)
 
 if file_count > 0:
     print(f"Submitting {file_count} transcription jobs...")
-    for row in unprocessed_files.collect():
-        job_result = start_transcribe_job(row['file_key'], row['file_name'])
-        submitted_jobs.append(job_result)
-        print(f"  ✓ Submitted: {job_result['job_name']}")
-        time.sleep(0.5)  # Small delay for rate limiting
+    submitted_jobs = run_async(submit_all(unprocessed_files))
+    for job_result in submitted_jobs:
+        if job_result['status'] == 'SUBMITTED':
+            print(f"  ✓ Submitted: {job_result['job_name']}")
+        elif job_result['status'] == 'ALREADY_SUBMITTED':
+            print(f"  ↺ Already submitted: {job_result['job_name']}")
+        else:
+            print(f"  ✗ Failed to submit {job_result['job_name']}: {job_result['error']}")
     
-    submitted_df = spark.createDataFrame(submitted_jobs)
+    submitted_df = spark.createDataFrame(submitted_jobs, schema=submitted_jobs_schema)
     display(submitted_df)
+    
+    # Record which audio file each job transcribes, so ingested results can be matched back to it
+    # (merged on job name, since a job submitted by an earlier run may already be recorded)
+    submitted_df.where("status IN ('SUBMITTED', 'ALREADY_SUBMITTED')") \
+        .select("job_name", "file_key", "file_name", "submit_time") \
+        .createOrReplaceTempView("submitted_jobs_tmp")
+    spark.sql(f"""
+        MERGE INTO {jobs_table} t
+        USING submitted_jobs_tmp s
+        ON t.job_name = s.job_name
+        WHEN NOT MATCHED THEN INSERT *
+    """)
 else:
     print("No files to process")
-    submitted_df = spark.createDataFrame([], schema="job_name STRING, status STRING, file_key STRING, file_name STRING, media_uri STRING, submit_time TIMESTAMP")
+    submitted_df = spark.createDataFrame([], schema=submitted_jobs_schema)
 
 # COMMAND ----------
 
 %md
 ### Monitor Transcription Job Status
-Poll AWS Transcribe to check job completion status
+Wait for AWS Transcribe jobs to complete using the SDK waiter
 
 # COMMAND ----------
 
@@ -250,49 +396,69 @@ def check_transcription_status(job_name):
             'error': str(e)
         }
 
-def poll_for_completion(job_names, max_wait_minutes=30, poll_interval=30):
-    """Poll transcription jobs until complete or timeout"""
+def wait_for_job(job_name, delay, deadline):
+    """Block on the SDK waiter until a job finishes or the shared deadline passes, and return its status"""
+    # Jobs that only get a worker after the deadline go straight to the final status check
+    max_attempts = int((deadline - time.monotonic()) // delay)
+    if max_attempts > 0:
+        try:
+            transcribe_client.get_waiter('transcription_job_completed').wait(
+                TranscriptionJobName=job_name,
+                WaiterConfig={'Delay': delay, 'MaxAttempts': max_attempts}
+            )
+        except WaiterError:
+            pass  # FAILED jobs and timeouts are reported from the final status below
+    return check_transcription_status(job_name)
+
+def poll_for_completion(job_names, max_wait_minutes=30, poll_interval=20, max_workers=8):
+    """Wait for transcription jobs to complete or time out, using one waiter per job"""
     
     if not job_names:
         print("No jobs to poll")
         return []
     
-    start_time = time.time()
-    max_wait_seconds = max_wait_minutes * 60
-    completed = []
+    # One deadline for the whole batch, however many jobs are queued behind the workers
+    deadline = time.monotonic() + max_wait_minutes * 60
     
-    print(f"Polling {len(job_names)} jobs (max wait: {max_wait_minutes} minutes)...")
+    print(f"Waiting on {len(job_names)} jobs (max wait: {max_wait_minutes} minutes)...")
     
-    while job_names and (time.time() - start_time) < max_wait_seconds:
-        remaining = []
-        
-        for job_name in job_names:
-            status = check_transcription_status(job_name)
-            
-            if status['status'] in ['COMPLETED', 'FAILED']:
-                completed.append(status)
-                print(f"  {'✓' if status['status'] == 'COMPLETED' else '✗'} {job_name}: {status['status']}")
-            else:
-                remaining.append(job_name)
-        
-        job_names = remaining
-        
-        if job_names:
-            elapsed = int(time.time() - start_time)
-            print(f"  ⏳ Waiting for {len(job_names)} jobs... ({elapsed}s elapsed, sleeping {poll_interval}s)")
-            time.sleep(poll_interval)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        statuses = list(executor.map(lambda job_name: wait_for_job(job_name, poll_interval, deadline), job_names))
     
-    if job_names:
-        print(f"⚠ Timeout reached. {len(job_names)} jobs still in progress")
+    completed = []
+    pending = 0
+    errors = 0
+    for status in statuses:
+        if status['status'] in ['COMPLETED', 'FAILED']:
+            completed.append(status)
+            print(f"  {'✓' if status['status'] == 'COMPLETED' else '✗'} {status['job_name']}: {status['status']}")
+        elif status['status'] == 'ERROR':
+            errors += 1
+            print(f"  ⚠ Could not get status of {status['job_name']}: {status['error']}")
+        else:
+            pending += 1
+    
+    if pending:
+        print(f"⚠ Timeout reached. {pending} jobs still in progress")
+    if errors:
+        print(f"⚠ {errors} jobs could not be checked")
     
     return completed
 
+completed_jobs_schema = StructType([
+    StructField("job_name", StringType(), False),
+    StructField("status", StringType(), False),
+    StructField("transcript_uri", StringType(), True),
+    StructField("completion_time", TimestampType(), True),
+    StructField("failure_reason", StringType(), True)
+])
+
 # Get job names from submitted jobs
-job_names = [job['job_name'] for job in submitted_jobs if job['status'] == 'SUBMITTED']
-completed_jobs = poll_for_completion(job_names, max_wait_minutes=30, poll_interval=30)
+job_names = [job['job_name'] for job in submitted_jobs if job['status'] in ('SUBMITTED', 'ALREADY_SUBMITTED')]
+completed_jobs = poll_for_completion(job_names, max_wait_minutes=30, poll_interval=20)
 
 if completed_jobs:
-    completed_df = spark.createDataFrame(completed_jobs)
+    completed_df = spark.createDataFrame(completed_jobs, schema=completed_jobs_schema)
     display(completed_df)
 else:
     print("No completed jobs to display")
@@ -300,128 +466,154 @@ else:
 # COMMAND ----------
 
 %md
-### Download and Parse Transcription Results
-Retrieve the transcription JSON from S3 and extract the text and metadata
+### Ingest Transcription Results with Auto Loader
+Incrementally load new Transcribe output JSON from S3 into a typed Delta table.
+The cluster needs read access to the Transcribe output bucket (instance profile or Unity Catalog external location).
+
+A new checkpoint loads every output file already in the bucket. Jobs that are already in `raw_transcriptions` (e.g. written by an earlier version of this notebook) are skipped, so they aren't ingested twice.
 
 # COMMAND ----------
 
-def parse_transcription_result(transcript_uri):
-    """Download and parse the transcription JSON from S3"""
-    
-    # Download the JSON file
-    response = requests.get(transcript_uri)
-    transcript_data = response.json()
-    
-    # Extract key information
-    results = transcript_data.get('results', {})
-    
-    return {
-        'full_transcript': results.get('transcripts', [{}])[0].get('transcript', ''),
-        'items': results.get('items', []),
-        'speaker_labels': results.get('speaker_labels', {}).get('segments', []),
-        'raw_json': json.dumps(transcript_data)
-    }
-
-# Process completed transcriptions
-transcription_records = []
-
-print("Processing completed transcriptions...")
-for job in completed_jobs:
-    if job['status'] == 'COMPLETED' and job.get('transcript_uri'):
-        try:
-            # Parse the transcription
-            parsed = parse_transcription_result(job['transcript_uri'])
-            
-            # Find original file info
-            original_file = next(
-                (f for f in submitted_jobs if f['job_name'] == job['job_name']), 
-                None
-            )
-            
-            transcription_records.append({
-                'job_name': job['job_name'],
-                'file_key': original_file['file_key'] if original_file else None,
-                'file_name': original_file['file_name'] if original_file else None,
-                'transcript_text': parsed['full_transcript'],
-                'transcript_json': parsed['raw_json'],
-                'transcription_timestamp': job['completion_time'],
-                'ingestion_timestamp': datetime.now()
-            })
-            print(f"  ✓ Parsed: {job['job_name']}")
-        except Exception as e:
-            print(f"  ✗ Failed to parse {job['job_name']}: {e}")
+# Typed schema of the Transcribe output JSON (only the fields used downstream)
+transcribe_schema = """
+  jobName STRING,
+  results STRUCT<
+    transcripts: ARRAY<STRUCT<transcript: STRING>>,
+    speaker_labels: STRUCT<
+      segments: ARRAY<STRUCT<
+        speaker_label: STRING,
+        start_time: STRING,
+        end_time: STRING,
+        items: ARRAY<STRUCT<
+          speaker_label: STRING,
+          start_time: STRING,
+          end_time: STRING
+        >>
+      >>
+    >,
+    items: ARRAY<STRUCT<
+      start_time: STRING,
+      end_time: STRING,
+      alternatives: ARRAY<STRUCT<
+        confidence: STRING,
+        content: STRING
+      >>,
+      type: STRING
+    >>
+  >
+"""
+
+# Latest ingestion before this run; None when nothing has been ingested yet
+if spark.catalog.tableExists(raw_table):
+    last_ingestion = spark.table(raw_table).selectExpr("MAX(ingestion_timestamp)").first()[0]
+else:
+    last_ingestion = None
+
+# Original file info for each job (re-read by every micro-batch)
+jobs_df = spark.table(jobs_table).select("job_name", "file_key", "file_name")
+
+# Only *.json, which skips the write-access check file Transcribe leaves in the bucket
+transcripts_stream = (
+    spark.readStream.format("cloudFiles")
+    .option("cloudFiles.format", "json")
+    .option("pathGlobFilter", "*.json")
+    .schema(transcribe_schema)
+    .load(f"s3://{transcribe_output_bucket}/")
+    .select(
+        col("jobName").alias("job_name"),
+        col("results.transcripts")[0]["transcript"].alias("transcript_text"),
+        "results",
+        col("_metadata.file_modification_time").alias("transcription_timestamp"),
+        current_timestamp().alias("ingestion_timestamp")
+    )
+    .join(jobs_df, "job_name", "left")
+)
 
-print(f"\nSuccessfully processed {len(transcription_records)} transcriptions")
+# Skip jobs that are already ingested, so a new checkpoint's backfill doesn't duplicate them
+if last_ingestion is not None:
+    transcripts_stream = transcripts_stream.join(spark.table(raw_table).select("job_name"), "job_name", "left_anti")
+
+query = (
+    transcripts_stream
+    .writeStream
+    .option("checkpointLocation", checkpoint_path)
+    .option("mergeSchema", "true")
+    .trigger(availableNow=True)
+    .toTable(raw_table)
+)
+query.awaitTermination()
+
+print(f"✓ Ingested new transcription results into {raw_table}")
+new_transcripts_df = spark.table(raw_table)
+if last_ingestion is not None:
+    new_transcripts_df = new_transcripts_df.where(col("ingestion_timestamp") > lit(last_ingestion))
+display(new_transcripts_df.select("job_name", "file_name", "transcript_text", "transcription_timestamp"))
 
 # COMMAND ----------
 
 %md
-### Write Raw Transcriptions to Delta Table
+### Process Transcriptions with Speaker Diarization
+Merge the speaker segments of newly ingested transcriptions into a structured table.
+Only raw rows ingested after the latest one already processed are read.
+Tables created by earlier versions of this notebook are dropped once if their layout can't take these merges, and rebuilt from the raw data.
 
 # COMMAND ----------
 
-if transcription_records:
-    # Create DataFrame
-    transcripts_df = spark.createDataFrame(transcription_records)
-    
-    # Write to raw transcriptions table
-    transcripts_df.write \
-        .format("delta") \
-        .mode("append") \
-        .option("mergeSchema", "true") \
-        .saveAsTable(raw_table)
-    
-    print(f"✓ Wrote {len(transcription_records)} transcriptions to {raw_table}")
-    display(transcripts_df.select("job_name", "file_name", "transcript_text", "transcription_timestamp"))
-else:
-    print("No transcription records to write")
+# Earlier versions stored the segment times in call_transcripts as strings, which the DOUBLE merge can't insert into
+if spark.catalog.tableExists(processed_table):
+    segment_type = spark.table(processed_table).schema["speaker_segments"].dataType.elementType
+    if segment_type["start_time"].dataType != DoubleType():
+        spark.sql(f"DROP TABLE {processed_table}")
+        print(f"✓ Dropped {processed_table} (string segment times), it is rebuilt below")
 
-# COMMAND ----------
-
-%md
-### Process Transcriptions with Speaker Diarization
-Create a structured table with speaker segments extracted from the JSON
+# Earlier versions rebuilt speaker_utterances with CREATE OR REPLACE and had no processed_timestamp watermark
+utterances_table = f"{catalog}.{schema}.speaker_utterances"
+if spark.catalog.tableExists(utterances_table) and "processed_timestamp" not in spark.table(utterances_table).columns:
+    spark.sql(f"DROP TABLE {utterances_table}")
+    print(f"✓ Dropped {utterances_table} (old layout), it is rebuilt below")
 
 # COMMAND ----------
 
 %sql
-CREATE OR REPLACE TABLE ${catalog}.${schema}.call_transcripts AS
+-- Source projection, shared by the table definition and the merge so the two schemas can't drift apart
+CREATE OR REPLACE TEMP VIEW call_transcripts_src AS
 SELECT 
   job_name,
   file_key,
   file_name,
   transcript_text,
-  from_json(
-    transcript_json, 
-    'results STRUCT<
-      speaker_labels: STRUCT<
-        segments: ARRAY<STRUCT<
-          speaker_label: STRING,
-          start_time: STRING,
-          end_time: STRING,
-          items: ARRAY<STRUCT<
-            speaker_label: STRING,
-            start_time: STRING,
-            end_time: STRING
-          >>
-        >>
-      >,
-      items: ARRAY<STRUCT<
-        start_time: STRING,
-        end_time: STRING,
-        alternatives: ARRAY<STRUCT<
-          confidence: STRING,
-          content: STRING
-        >>,
-        type: STRING
-      >>
-    >'
-  ).results.speaker_labels.segments as speaker_segments,
+  -- Segment times arrive as strings; cast them to DOUBLE once here instead of on every read
+  transform(results.speaker_labels.segments, segment -> named_struct(
+    'speaker_label', segment.speaker_label,
+    'start_time', CAST(segment.start_time AS DOUBLE),
+    'end_time', CAST(segment.end_time AS DOUBLE),
+    'items', transform(segment.items, item -> named_struct(
+      'speaker_label', item.speaker_label,
+      'start_time', CAST(item.start_time AS DOUBLE),
+      'end_time', CAST(item.end_time AS DOUBLE)
+    ))
+  )) as speaker_segments,
   transcription_timestamp,
   ingestion_timestamp,
   current_timestamp() as processed_timestamp
 FROM ${catalog}.${schema}.raw_transcriptions
-WHERE transcription_timestamp IS NOT NULL
+WHERE transcription_timestamp IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS ${catalog}.${schema}.call_transcripts AS
+SELECT * FROM call_transcripts_src WHERE 1 = 0;
+
+MERGE INTO ${catalog}.${schema}.call_transcripts t
+USING (
+  SELECT * FROM call_transcripts_src
+  WHERE ingestion_timestamp > (
+    SELECT COALESCE(MAX(ingestion_timestamp), TIMESTAMP '1970-01-01')
+    FROM ${catalog}.${schema}.call_transcripts
+  )
+) s
+ON t.job_name = s.job_name
+WHEN NOT MATCHED THEN INSERT *;
+
+OPTIMIZE ${catalog}.${schema}.call_transcripts ZORDER BY (file_key);
 
 # COMMAND ----------
 
@@ -436,29 +628,51 @@ display(spark.table(f"{catalog}.{schema}.call_transcripts"))
 
 %md
 ### Extract Speaker Utterances (Optional)
-Explode speaker segments into individual utterances for analysis
+Explode the speaker segments of newly processed calls into individual utterances for analysis
 
 # COMMAND ----------
 
 %sql
-CREATE OR REPLACE TABLE ${catalog}.${schema}.speaker_utterances AS
+-- Source projection, shared by the table definition and the merge
+CREATE OR REPLACE TEMP VIEW speaker_utterances_src AS
 SELECT 
   job_name,
   file_name,
   segment.speaker_label,
-  CAST(segment.start_time AS DOUBLE) as start_time_seconds,
-  CAST(segment.end_time AS DOUBLE) as end_time_seconds,
-  CAST(segment.end_time AS DOUBLE) - CAST(segment.start_time AS DOUBLE) as duration_seconds,
+  segment.start_time as start_time_seconds,
+  segment.end_time as end_time_seconds,
+  segment.end_time - segment.start_time as duration_seconds,
   -- Extract text for this speaker segment (requires joining with items)
   transcript_text,
-  transcription_timestamp
+  transcription_timestamp,
+  processed_timestamp
 FROM ${catalog}.${schema}.call_transcripts
-LATERAL VIEW explode(speaker_segments) as segment
-ORDER BY job_name, start_time_seconds
+LATERAL VIEW explode(speaker_segments) as segment;
+
+CREATE TABLE IF NOT EXISTS ${catalog}.${schema}.speaker_utterances AS
+SELECT * FROM speaker_utterances_src WHERE 1 = 0;
+
+MERGE INTO ${catalog}.${schema}.speaker_utterances t
+USING (
+  SELECT * FROM speaker_utterances_src
+  WHERE processed_timestamp > (
+    SELECT COALESCE(MAX(processed_timestamp), TIMESTAMP '1970-01-01')
+    FROM ${catalog}.${schema}.speaker_utterances
+  )
+) s
+ON t.job_name = s.job_name
+WHEN NOT MATCHED THEN INSERT *;
+
+-- Co-locate each call's utterances on disk instead of globally sorting them on write
+OPTIMIZE ${catalog}.${schema}.speaker_utterances ZORDER BY (job_name, start_time_seconds);
 
 # COMMAND ----------
 
-display(spark.table(f"{catalog}.{schema}.speaker_utterances"))
+# Cache the freshly merged table once and reuse it for display and the summary statistics below
+su_df = spark.table(f"{catalog}.{schema}.speaker_utterances").cache()
+su_df.count()
+su_df.createOrReplaceTempView("speaker_utterances_tmp")
+display(su_df)
 
 # COMMAND ----------
 
@@ -474,7 +688,12 @@ SELECT
   ROUND(AVG(duration_seconds), 2) as avg_utterance_duration_sec,
   ROUND(SUM(duration_seconds) / 60, 2) as total_audio_minutes,
   MAX(transcription_timestamp) as last_processed
-FROM ${catalog}.${schema}.speaker_utterances
+FROM speaker_utterances_tmp
+
+# COMMAND ----------
+
+# Release the cached results
+su_df.unpersist()
 
 # COMMAND ----------
 
@@ -484,23 +703,31 @@ Delete completed jobs from AWS Transcribe to manage quota
 
 # COMMAND ----------
 
-def cleanup_transcribe_jobs(job_names):
+def _delete_one(job_name):
+    """Delete a single transcription job, returning the error message if it fails"""
+    try:
+        transcribe_client.delete_transcription_job(
+            TranscriptionJobName=job_name
+        )
+        return None
+    except Exception as e:
+        return str(e)
+
+def cleanup_transcribe_jobs(job_names, max_workers=16):
     """Delete completed transcription jobs to manage quota"""
-    deleted = 0
-    failed = 0
+    # DeleteTranscriptionJob doesn't share the StartTranscriptionJob quota; throttling is retried by the client
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = list(executor.map(_delete_one, job_names))
     
-    for job_name in job_names:
-        try:
-            transcribe_client.delete_transcription_job(
-                TranscriptionJobName=job_name
-            )
-            deleted += 1
+    failed = 0
+    for job_name, error in zip(job_names, errors):
+        if error is None:
             print(f"  ✓ Deleted: {job_name}")
-        except Exception as e:
+        else:
             failed += 1
-            print(f"  ✗ Failed to delete {job_name}: {e}")
+            print(f"  ✗ Failed to delete {job_name}: {error}")
     
-    print(f"\n✓ Deleted {deleted} jobs, {failed} failures")
+    print(f"\n✓ Deleted {len(job_names) - failed} jobs, {failed} failures")
 
 # Uncomment the following lines to clean up jobs after successful processing
 # completed_job_names = [job['job_name'] for job in completed_jobs if job['status'] == 'COMPLETED']